@@ -0,0 +1,26 @@
+
+import os
+from dotenv import load_dotenv
+
+# Загрузка переменных окружения
+load_dotenv()
+
+# Получение токенов из переменных окружения
+TELEGRAM_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
+WEATHER_API_KEY = os.getenv('OPENWEATHER_API_KEY')
+CITY = os.getenv('CITY', 'Moscow')
+CITIES = [c.strip() for c in os.getenv('CITIES', CITY).split(',') if c.strip()]
+OWM_CONCURRENCY = os.getenv('OWM_CONCURRENCY', '4')
+WEATHER_CACHE_DB = os.getenv('WEATHER_CACHE_DB', 'weather_cache.sqlite3')
+
+# Проверка наличия всех необходимых переменных
+if not TELEGRAM_TOKEN:
+    raise ValueError("TELEGRAM_BOT_TOKEN не установлен! Добавьте его в файл .env")
+if not CHAT_ID:
+    raise ValueError("TELEGRAM_CHAT_ID не установлен! Добавьте его в файл .env")
+if not WEATHER_API_KEY:
+    raise ValueError("OPENWEATHER_API_KEY не установлен! Добавьте его в файл .env")
+if not OWM_CONCURRENCY.strip().isdigit() or int(OWM_CONCURRENCY) < 1:
+    raise ValueError("OWM_CONCURRENCY должен быть целым числом не меньше 1! Исправьте его в файле .env")
+OWM_CONCURRENCY = int(OWM_CONCURRENCY)
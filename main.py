@@ -1,38 +1,24 @@
 
-import os
-import requests
-from datetime import datetime
-from dotenv import load_dotenv
+import sys
+import queue
+import signal
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime, timedelta
 from telegram import Bot, Update
 from telegram.ext import Application, CommandHandler, ContextTypes
-from telegram.error import TelegramError
+from telegram.error import NetworkError, RetryAfter, TelegramError, TimedOut
 import asyncio
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
+from config import TELEGRAM_TOKEN, CHAT_ID, CITIES
+from weather import (
+    open_session, close_session, open_cache, close_cache, format_weather_messages,
+    get_weather_many, resolve_city_ids, with_retries
+)
 
-# Загрузка переменных окружения
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-# Получение токенов из переменных окружения
-TELEGRAM_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
-WEATHER_API_KEY = os.getenv('OPENWEATHER_API_KEY')
-CITY = os.getenv('CITY', 'Moscow')
-
-# Проверка наличия всех необходимых переменных
-if not TELEGRAM_TOKEN:
-    raise ValueError("TELEGRAM_BOT_TOKEN не установлен! Добавьте его в файл .env")
-if not CHAT_ID:
-    raise ValueError("TELEGRAM_CHAT_ID не установлен! Добавьте его в файл .env")
-if not WEATHER_API_KEY:
-    raise ValueError("OPENWEATHER_API_KEY не установлен! Добавьте его в файл .env")
-
-# Создание приложения Telegram
-application = Application.builder().token(TELEGRAM_TOKEN).build()
-
-async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /start"""
-    welcome_message = """
+# Приветственное сообщение для команды /start
+WELCOME_MESSAGE = """
 🤖 Добро пожаловать в Погодный Бот!
 
 Я предоставляю актуальную информацию о погоде.
@@ -42,135 +28,198 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /weather - получить текущую погоду
 
 📍 Автоматическая отправка прогноза каждый день в 08:00
+""".strip()
+
+WEATHER_ERROR_MESSAGE = "❌ Не удалось получить данные о погоде. Попробуйте позже."
+
+# Максимальное время (секунд) на каждый шаг остановки бота
+SHUTDOWN_TIMEOUT = 5
+
+# Максимальный отрезок сна (секунд) при ожидании ежедневной отправки
+DAILY_CHECK_INTERVAL = 60
+
+# Ссылки на запущенные фоновые задачи (чтобы их не удалил сборщик мусора)
+_background_tasks: set[asyncio.Task] = set()
+
+def setup_logging() -> QueueListener:
     """
-    await update.message.reply_text(welcome_message.strip())
+    Настраивает логирование: запись в поток выполняется в отдельном потоке
+    через очередь, чтобы не блокировать цикл событий
+    """
+    log_queue = queue.Queue(-1)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    # Форматирование выполняет только stream_handler: QueueHandler без своего
+    # форматтера передаёт в очередь исходное сообщение
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(QueueHandler(log_queue))
+    # httpx пишет INFO на каждый запрос long polling
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    listener = QueueListener(log_queue, stream_handler)
+    listener.start()
+    return listener
+
+async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /start"""
+    await update.message.reply_text(WELCOME_MESSAGE)
 
 async def weather_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /weather"""
     try:
-        weather_data = get_weather(CITY)
+        weather_data = await get_weather_many(CITIES)
         
-        if weather_data:
-            message = format_weather_message(weather_data)
-            await update.message.reply_text(message)
+        if any(weather_data.values()):
+            for message in format_weather_messages(weather_data):
+                await update.message.reply_text(message)
         else:
-            await update.message.reply_text("❌ Не удалось получить данные о погоде. Попробуйте позже.")
+            await update.message.reply_text(WEATHER_ERROR_MESSAGE)
             
     except Exception as e:
         await update.message.reply_text(f"❌ Произошла ошибка: {str(e)}")
 
-def get_weather(city: str) -> dict:
+async def send_weather_update(bot: Bot):
     """
-    Получает данные о погоде из OpenWeatherMap API
+    Автоматическая отправка прогноза погоды
     """
-    url = "http://api.openweathermap.org/data/2.5/weather"
-    
-    params = {
-        'q': city,
-        'appid': WEATHER_API_KEY,
-        'units': 'metric',
-        'lang': 'ru'
-    }
+    logger.info("Получение прогноза погоды...")
+
+    weather_data = await get_weather_many(CITIES, no_cache=True)
+    messages = format_weather_messages(weather_data)
 
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        return response.json()
+        for message in messages:
+            await with_retries(
+                lambda: bot.send_message(chat_id=CHAT_ID, text=message),
+                retry_on=(NetworkError, RetryAfter),
+                # Тайм-аут ответа не означает, что сообщение не доставлено:
+                # повтор sendMessage может отправить прогноз несколько раз
+                no_retry=(TimedOut,)
+            )
+        logger.info("Сообщение успешно отправлено!")
 
-    except requests.exceptions.RequestException as e:
-        print(f"Ошибка при получении данных о погоде: {e}")
-        return None
+    except TelegramError as e:
+        logger.error("Ошибка при отправке сообщения в Telegram: %s", e)
 
-def format_weather_message(weather_data: dict) -> str:
+async def daily_at(hour: int, minute: int, coro):
     """
-    Форматирует данные о погоде в читаемое сообщение
+    Запускает корутину coro() каждый день в указанное локальное время
     """
-    if not weather_data:
-        return "❌ Не удалось получить данные о погоде."
-
-    city_name = weather_data['name']
-    temp = round(weather_data['main']['temp'])
-    feels_like = round(weather_data['main']['feels_like'])
-    description = weather_data['weather'][0]['description'].capitalize()
-    humidity = weather_data['main']['humidity']
-    wind_speed = weather_data['wind']['speed']
-
-    message = f"""
-🌤 Прогноз погоды для города {city_name}
-
-🌡 Температура: {temp}°C
-🤔 Ощущается как: {feels_like}°C
-☁️ Описание: {description}
-💧 Влажность: {humidity}%
-💨 Скорость ветра: {wind_speed} м/с
-
-📅 Дата: {datetime.now().strftime('%d.%m.%Y')}
-⏰ Время: {datetime.now().strftime('%H:%M')}
-    """
-
-    return message.strip()
+    now = datetime.now()
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+
+    while True:
+        # Сон короткими отрезками со сверкой по настенным часам: asyncio.sleep
+        # идёт по монотонным часам, которые расходятся с локальным временем при
+        # переходе на летнее время, переводе часов или сне хоста. Заодно
+        # досыпаем, если таймер сработал чуть раньше срока
+        while (delay := (target - datetime.now()).total_seconds()) > 0:
+            await asyncio.sleep(min(delay, DAILY_CHECK_INTERVAL))
+        task = asyncio.create_task(coro())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+        # Следующий запуск считается от предыдущего, а не от текущего времени,
+        # чтобы ранний таймер не привёл к повторной отправке
+        while target <= datetime.now():
+            target += timedelta(days=1)
 
-async def send_weather_update():
+async def main():
     """
-    Автоматическая отправка прогноза погоды
+    Основная функция запуска бота
     """
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Получение прогноза погоды...")
-
-    weather_data = get_weather(CITY)
-    message = format_weather_message(weather_data)
-
+    log_listener = setup_logging()
     try:
-        bot = Bot(token=TELEGRAM_TOKEN)
-        await bot.send_message(chat_id=CHAT_ID, text=message)
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Сообщение успешно отправлено!")
-
-    except TelegramError as e:
-        print(f"Ошибка при отправке сообщения в Telegram: {e}")
+        await run_bot()
+    finally:
+        # Записи, оставшиеся в очереди, выводятся даже при ошибке запуска
+        log_listener.stop()
 
-async def main():
+async def run_bot():
     """
-    Основная функция запуска бота
+    Запуск бота и ожидание сигнала остановки
     """
-    print("🤖 Погодный бот запущен!")
-    print(f"📍 Город: {CITY}")
-    print(f"⏰ Прогноз будет отправляться ежедневно в 08:00")
-    print("-" * 50)
+    logger.info("🤖 Погодный бот запущен!")
+    logger.info("📍 Город: %s", ', '.join(CITIES))
+    logger.info("⏰ Прогноз будет отправляться ежедневно в 08:00")
+
+    # Создание приложения Telegram
+    application = Application.builder().token(TELEGRAM_TOKEN).build()
 
     # Регистрация обработчиков команд
     application.add_handler(CommandHandler("start", start_handler))
     application.add_handler(CommandHandler("weather", weather_handler))
 
-    # Инициализация и запуск приложения
-    await application.initialize()
-    await application.start()
-    await application.updater.start_polling()
-
-    # Настройка планировщика для ежедневной отправки
-    scheduler = AsyncIOScheduler()
-    scheduler.add_job(
-        send_weather_update,
-        trigger=CronTrigger(hour=8, minute=0),
-        id='weather_update',
-        name='Ежедневная отправка прогноза погоды',
-        replace_existing=True
-    )
-    scheduler.start()
-
-    print("✅ Планировщик запущен. Ожидание следующей отправки...")
-    print("✅ Обработчик команд /start и /weather активен!")
-    print("Нажмите Ctrl+C для остановки бота")
-
+    # Создание HTTP-сессии для запросов к OpenWeatherMap и загрузка кэша с диска
+    open_session()
     try:
-        # Бесконечный цикл для поддержания работы бота
-        while True:
-            await asyncio.sleep(1)
-    except (KeyboardInterrupt, SystemExit):
-        print("\n🛑 Остановка бота...")
-        scheduler.shutdown()
-        await application.updater.stop()
-        await application.stop()
-        await application.shutdown()
-        print("✅ Бот успешно остановлен")
+        open_cache()
+
+        # Прогрев соединений к api.openweathermap.org и api.telegram.org:
+        # определение ID городов (запросы find или, если все ID уже в кэше,
+        # один HEAD-запрос) и инициализация бота
+        # (get_me, заодно проверяет токен) выполняются параллельно
+        await asyncio.gather(resolve_city_ids(CITIES), application.initialize())
+
+        # Запуск приложения
+        await application.start()
+        await application.updater.start_polling()
+
+        # Ежедневная отправка прогноза в 08:00 по локальному времени
+        scheduler = asyncio.create_task(
+            daily_at(8, 0, lambda: send_weather_update(application.bot))
+        )
+
+        logger.info("✅ Планировщик запущен. Ожидание следующей отправки...")
+        logger.info("✅ Обработчик команд /start и /weather активен!")
+        logger.info("Нажмите Ctrl+C для остановки бота")
+
+        # Ожидание сигнала остановки без периодических пробуждений
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                # Windows: обработчики сигналов недоступны, остаётся KeyboardInterrupt
+                pass
+
+        try:
+            await stop.wait()
+        except (KeyboardInterrupt, SystemExit, asyncio.CancelledError):
+            pass
+
+        logger.info("🛑 Остановка бота...")
+        scheduler.cancel()
+        # Каждый шаг ограничен по времени, чтобы зависшее соединение не блокировало остановку
+        for step in (application.updater.stop, application.stop, application.shutdown):
+            try:
+                await asyncio.wait_for(step(), timeout=SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("Превышено время ожидания при остановке: %s", step.__qualname__)
+            except Exception as e:
+                # Ошибка одного шага не должна мешать остальной очистке
+                logger.error("Ошибка при остановке (%s): %s", step.__qualname__, e)
+    finally:
+        # Отмена оставшихся задач (незавершённой отправки прогноза или, при ошибке
+        # запуска, определения ID городов) до закрытия HTTP-сессии и кэша
+        pending = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        await close_session()
+        close_cache()
+
+    logger.info("✅ Бот успешно остановлен")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # uvloop не поддерживает Windows - там используется стандартный цикл событий
+    if sys.platform != 'win32':
+        import uvloop
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
\ No newline at end of file
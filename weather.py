@@ -0,0 +1,382 @@
+
+import time
+import random
+import sqlite3
+import asyncio
+import logging
+from datetime import datetime
+import aiohttp
+import orjson
+from config import WEATHER_API_KEY, OWM_CONCURRENCY, WEATHER_CACHE_DB
+
+logger = logging.getLogger(__name__)
+
+# Общая HTTP-сессия для запросов к OpenWeatherMap (создаётся в open_session())
+SESSION: aiohttp.ClientSession | None = None
+
+# Ограничение числа одновременных запросов к OpenWeatherMap
+_OWM_SEM = asyncio.Semaphore(OWM_CONCURRENCY)
+
+# Кэш ответов OpenWeatherMap: город -> (время получения, данные).
+# Дублируется в SQLite, чтобы переживать перезапуск бота
+WEATHER_TTL = 300  # секунд; OWM обновляет данные примерно раз в 10 минут
+_CACHE: dict[str, tuple[float, dict]] = {}
+_DB: sqlite3.Connection | None = None
+
+# ID городов OpenWeatherMap (заполняется при запуске) для пакетных запросов /group
+OWM_GROUP_LIMIT = 20  # максимум городов в одном запросе /group
+_CITY_IDS: dict[str, int] = {}
+
+# Максимальная длина сообщения Telegram (в единицах UTF-16)
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Сообщение для города, по которому не удалось получить данные
+NO_DATA_TEMPLATE = "❌ Нет данных о погоде для города {city_name}"
+
+# Шаблон сообщения с прогнозом (подготавливается один раз при импорте)
+WEATHER_TEMPLATE = """
+🌤 Прогноз погоды для города {city_name}
+
+🌡 Температура: {temp}
+🤔 Ощущается как: {feels_like}
+☁️ Описание: {description}
+💧 Влажность: {humidity}
+💨 Скорость ветра: {wind_speed}
+
+📅 Дата: {date}
+⏰ Время: {time}
+""".strip()
+
+async def with_retries(fn, *, retry_on, no_retry=(), attempts: int = 4, base: float = 0.5):
+    """
+    Вызывает корутину fn() с повторами при временных ошибках
+    (экспоненциальная задержка со случайным разбросом).
+    Исключения из no_retry не повторяются, даже если входят в retry_on
+    """
+    for attempt in range(attempts):
+        try:
+            return await fn()
+        except retry_on as e:
+            if isinstance(e, no_retry):
+                raise
+            # Ошибки клиента (4xx, кроме 429) повторять бессмысленно
+            if isinstance(e, aiohttp.ClientResponseError) and e.status < 500 and e.status != 429:
+                raise
+            if attempt == attempts - 1:
+                raise
+            delay = _retry_delay(e)
+            if delay is None:
+                delay = base * 2 ** attempt + random.random() * 0.2
+            await asyncio.sleep(delay)
+
+def _retry_delay(e: Exception) -> float | None:
+    """
+    Возвращает задержку, запрошенную сервером: retry_after у Telegram (RetryAfter)
+    или заголовок Retry-After в ответе OWM
+    """
+    retry_after = getattr(e, 'retry_after', None)
+    if retry_after is not None:
+        return retry_after
+    if isinstance(e, aiohttp.ClientResponseError) and e.headers:
+        try:
+            return float(e.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            # Заголовок отсутствует или задан датой - используется обычная задержка
+            return None
+    return None
+
+def open_session():
+    """
+    Создаёт общую HTTP-сессию (соединения переиспользуются между запросами)
+    """
+    global SESSION
+    SESSION = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300),
+        headers={'Accept-Encoding': 'gzip'}
+    )
+
+async def close_session():
+    """
+    Закрывает общую HTTP-сессию
+    """
+    if SESSION is not None:
+        await SESSION.close()
+
+def open_cache(path: str = WEATHER_CACHE_DB):
+    """
+    Открывает файл кэша и загружает из него ещё не устаревшие записи.
+    Если файл недоступен, бот продолжает работу с кэшем только в памяти
+    """
+    global _DB
+    try:
+        _DB = sqlite3.connect(path)
+        _DB.execute("PRAGMA journal_mode=WAL")
+        _DB.execute("PRAGMA synchronous=NORMAL")
+        _DB.execute("CREATE TABLE IF NOT EXISTS cache(city TEXT PRIMARY KEY, ts REAL, payload BLOB)")
+        rows = _DB.execute(
+            "SELECT city, ts, payload FROM cache WHERE ts > ?", (time.time() - WEATHER_TTL,)
+        ).fetchall()
+    except sqlite3.Error as e:
+        logger.warning("Файл кэша %s недоступен, кэш хранится только в памяти: %s", path, e)
+        close_cache()
+        return
+
+    for city, ts, payload in rows:
+        try:
+            _CACHE[city] = (ts, _slim(orjson.loads(payload)))
+        except orjson.JSONDecodeError:
+            # Повреждённая запись просто не попадает в кэш
+            continue
+
+def close_cache():
+    """
+    Закрывает файл кэша
+    """
+    global _DB
+    if _DB is not None:
+        try:
+            _DB.close()
+        except sqlite3.Error as e:
+            logger.warning("Ошибка при закрытии файла кэша: %s", e)
+        _DB = None
+
+def _store(city: str, ts: float, data: dict):
+    """
+    Сохраняет ответ в кэш (в памяти и на диске).
+    При ошибке записи на диск дальше используется только кэш в памяти
+    """
+    _CACHE[city] = (ts, data)
+    if _DB is not None:
+        try:
+            with _DB:
+                _DB.execute(
+                    "INSERT OR REPLACE INTO cache(city, ts, payload) VALUES (?, ?, ?)",
+                    (city, ts, orjson.dumps(data))
+                )
+        except sqlite3.Error as e:
+            logger.warning("Не удалось записать кэш на диск, кэш хранится только в памяти: %s", e)
+            close_cache()
+
+async def get_weather(city: str, no_cache: bool = False) -> dict:
+    """
+    Получает данные о погоде, используя кэш не старше WEATHER_TTL секунд
+    """
+    now = time.time()
+    hit = _CACHE.get(city)
+    if hit and not no_cache and now - hit[0] < WEATHER_TTL:
+        return hit[1]
+
+    data = await _fetch(city)
+    if data:
+        _store(city, now, data)
+        # ID из ответа позволяет в следующий раз запрашивать город через /group
+        if data.get('id'):
+            _CITY_IDS.setdefault(city, data['id'])
+    return data
+
+async def get_weather_many(cities: list[str], no_cache: bool = False) -> dict[str, dict | None]:
+    """
+    Получает данные о погоде для нескольких городов: город -> данные.
+    Города с известным ID запрашиваются через /group (до 20 за один запрос),
+    остальные - параллельными одиночными запросами. Если запрос не удался,
+    используется устаревшая запись кэша, а при её отсутствии - None
+    """
+    now = time.time()
+    result = {}
+    for city in cities:
+        hit = _CACHE.get(city)
+        if hit and not no_cache and now - hit[0] < WEATHER_TTL:
+            result[city] = hit[1]
+
+    missing = [city for city in cities if city not in result]
+    # Несколько названий (например, Moscow и Москва) могут указывать на один ID
+    by_id: dict[int, list[str]] = {}
+    for city in missing:
+        if city in _CITY_IDS:
+            by_id.setdefault(_CITY_IDS[city], []).append(city)
+    unresolved = [city for city in missing if city not in _CITY_IDS]
+    ids = list(by_id)
+    chunks = [ids[i:i + OWM_GROUP_LIMIT] for i in range(0, len(ids), OWM_GROUP_LIMIT)]
+
+    groups, singles = await asyncio.gather(
+        asyncio.gather(*(_fetch_group(chunk) for chunk in chunks)),
+        asyncio.gather(*(get_weather(city, no_cache) for city in unresolved))
+    )
+
+    for items in groups:
+        for data in items:
+            for city in by_id.get(data.get('id'), []):
+                _store(city, now, data)
+                result[city] = data
+    for city, data in zip(unresolved, singles):
+        if data:
+            result[city] = data
+
+    for city in cities:
+        if city not in result:
+            hit = _CACHE.get(city)
+            result[city] = hit[1] if hit else None
+
+    return {city: result[city] for city in cities}
+
+async def resolve_city_ids(cities: list[str]):
+    """
+    Определяет ID городов OpenWeatherMap. Запросы по ID быстрее и однозначнее.
+    ID берутся из свежих записей кэша (в том числе загруженных с диска),
+    для остальных городов выполняется поиск (find), заодно прогревающий кэш.
+    Нераспознанные города запрашиваются по названию
+    """
+    now = time.time()
+    missing = []
+    for city in cities:
+        hit = _CACHE.get(city)
+        if hit and now - hit[0] < WEATHER_TTL and hit[1].get('id'):
+            _CITY_IDS[city] = hit[1]['id']
+        else:
+            missing.append(city)
+
+    if not missing:
+        # Все ID известны из кэша - соединение с OWM прогревается отдельно
+        await _warm_up()
+        return
+
+    results = await asyncio.gather(*(_request("find", {'q': city}) for city in missing))
+    for city, data in zip(missing, results):
+        found = (data or {}).get('list') or []
+        if found and found[0].get('id'):
+            item = _slim(found[0])
+            _CITY_IDS[city] = item['id']
+            _store(city, now, item)
+
+async def _warm_up():
+    """
+    Устанавливает соединение с api.openweathermap.org лёгким запросом HEAD
+    (без ключа API, не расходует квоту)
+    """
+    try:
+        async with SESSION.head("https://api.openweathermap.org/",
+                                timeout=aiohttp.ClientTimeout(total=10)):
+            pass
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning("Не удалось прогреть соединение с OpenWeatherMap: %s", e)
+
+async def _fetch(city: str) -> dict:
+    """
+    Получает данные о погоде для одного города из OpenWeatherMap API
+    """
+    params = {'id': _CITY_IDS[city]} if city in _CITY_IDS else {'q': city}
+    data = await _request("weather", params)
+    return _slim(data) if data else data
+
+async def _fetch_group(ids: list[int]) -> list[dict]:
+    """
+    Получает данные о погоде для группы городов (по ID) одним запросом
+    """
+    data = await _request("group", {'id': ','.join(map(str, ids))})
+    return [_slim(item) for item in data.get('list', [])] if data else []
+
+def _slim(data: dict) -> dict:
+    """
+    Оставляет из ответа OWM только используемые поля, чтобы остальная
+    часть JSON (coord, sys, clouds и т.д.) не хранилась в кэше, и приводит
+    их к полному виду: все поля, нужные для сообщения, всегда присутствуют
+    (отсутствующие в ответе значения - None)
+    """
+    # Отдельные поля (например, wind.speed) иногда отсутствуют в ответе
+    main_blk = data.get('main', {})
+    wind_blk = data.get('wind', {})
+    weather_blk = (data.get('weather') or [{}])[0]
+    return {
+        'id': data.get('id'),
+        'name': data.get('name'),
+        'main': {
+            'temp': main_blk.get('temp'),
+            'feels_like': main_blk.get('feels_like'),
+            'humidity': main_blk.get('humidity'),
+        },
+        'weather': [{'description': weather_blk.get('description')}],
+        'wind': {'speed': wind_blk.get('speed')},
+    }
+
+async def _request(endpoint: str, params: dict) -> dict:
+    """
+    Выполняет запрос к OpenWeatherMap API
+    """
+    url = f"https://api.openweathermap.org/data/2.5/{endpoint}"
+
+    params = {
+        **params,
+        'appid': WEATHER_API_KEY,
+        'units': 'metric',
+        'lang': 'ru'
+    }
+
+    async def request():
+        async with _OWM_SEM:
+            async with SESSION.get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                response.raise_for_status()
+                return orjson.loads(await response.read())
+
+    try:
+        return await with_retries(request, retry_on=(aiohttp.ClientError, asyncio.TimeoutError))
+
+    except (aiohttp.ClientError, asyncio.TimeoutError, orjson.JSONDecodeError) as e:
+        logger.error("Ошибка при получении данных о погоде: %s", e)
+        return None
+
+def format_weather_messages(weather_data: dict[str, dict | None]) -> list[str]:
+    """
+    Форматирует данные о погоде (город -> данные в виде после _slim или None)
+    в читаемые сообщения, каждое из которых укладывается в лимит длины Telegram
+    """
+    if not any(weather_data.values()):
+        return ["❌ Не удалось получить данные о погоде."]
+
+    now = datetime.now()
+    date = now.strftime('%d.%m.%Y')
+    time_str = now.strftime('%H:%M')
+    messages = []
+    for city, item in weather_data.items():
+        if item is None:
+            messages.append(NO_DATA_TEMPLATE.format(city_name=city))
+            continue
+        messages.append(WEATHER_TEMPLATE.format_map({
+            'city_name': item['name'] or city,
+            'temp': _field(item['main']['temp'], lambda v: f"{round(v)}°C"),
+            'feels_like': _field(item['main']['feels_like'], lambda v: f"{round(v)}°C"),
+            'description': _field(item['weather'][0]['description'], str.capitalize),
+            'humidity': _field(item['main']['humidity'], lambda v: f"{v}%"),
+            'wind_speed': _field(item['wind']['speed'], lambda v: f"{v} м/с"),
+            'date': date,
+            'time': time_str,
+        }))
+    return _pack_messages(messages)
+
+def _field(value, fmt) -> str:
+    """
+    Форматирует значение поля; отсутствующее значение показывается как «—»
+    """
+    return "—" if value is None else fmt(value)
+
+def _pack_messages(blocks: list[str], sep: str = "\n\n") -> list[str]:
+    """
+    Объединяет блоки текста в как можно меньшее число сообщений
+    не длиннее TELEGRAM_MESSAGE_LIMIT
+    """
+    messages = []
+    current = ""
+    for block in blocks:
+        candidate = f"{current}{sep}{block}" if current else block
+        if current and _utf16_len(candidate) > TELEGRAM_MESSAGE_LIMIT:
+            messages.append(current)
+            current = block
+        else:
+            current = candidate
+    messages.append(current)
+    return messages
+
+def _utf16_len(text: str) -> int:
+    """
+    Длина строки так, как её считает Telegram (в единицах UTF-16)
+    """
+    return len(text.encode('utf-16-le')) // 2